@@ -21,10 +21,12 @@ import os
 import subprocess
 import sys
 
-sys.path.append('%s/external/icu/tools' % os.environ.get('ANDROID_BUILD_TOP'))
+# Look up the environment once: every path below hangs off the build top.
+android_build_top_env = os.environ.get('ANDROID_BUILD_TOP')
+sys.path.append('%s/external/icu/tools' % android_build_top_env)
 import i18nutil
 
-sys.path.append('%s/system/timezone' % os.environ.get('ANDROID_BUILD_TOP'))
+sys.path.append('%s/system/timezone' % android_build_top_env)
 import tzdatautil
 
 
@@ -35,7 +37,7 @@ i18nutil.CheckDirExists(timezone_dir, 'system/timezone')
 
 android_host_out = i18nutil.GetAndroidHostOutOrDie()
 
-debug_tools_dir = os.path.realpath('%s/system/timezone/debug_tools/host' % android_build_top)
+debug_tools_dir = '%s/debug_tools/host' % timezone_dir
 i18nutil.CheckDirExists(debug_tools_dir, 'system/timezone/debug_tools/host')
 
 
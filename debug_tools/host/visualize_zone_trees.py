@@ -22,10 +22,12 @@ import os
 import subprocess
 import sys
 
-sys.path.append('%s/external/icu/tools' % os.environ.get('ANDROID_BUILD_TOP'))
+# Look up the environment once: every path below hangs off the build top.
+android_build_top_env = os.environ.get('ANDROID_BUILD_TOP')
+sys.path.append('%s/external/icu/tools' % android_build_top_env)
 import i18nutil
 
-sys.path.append('%s/system/timezone' % os.environ.get('ANDROID_BUILD_TOP'))
+sys.path.append('%s/system/timezone' % android_build_top_env)
 import tzdatautil
 
 
@@ -17,48 +17,115 @@
 """Downloads the latest IANA time zone files."""
 
 import argparse
+import atexit
+import concurrent.futures
 import ftplib
 import os
 import shutil
 import subprocess
 import sys
+import tempfile
 
-sys.path.append('%s/external/icu/tools' % os.environ.get('ANDROID_BUILD_TOP'))
+# Look up the environment once: every path below hangs off the build top.
+android_build_top_env = os.environ.get('ANDROID_BUILD_TOP')
+sys.path.append('%s/external/icu/tools' % android_build_top_env)
 import i18nutil
 import tzdatautil
 
-# Calculate the paths that are referred to by multiple functions.
+# Calculate the paths that are referred to by multiple functions. timezone_dir
+# is resolved once; children of a resolved path don't need realpath again.
 android_build_top = i18nutil.GetAndroidRootOrDie()
-iana_data_dir = os.path.realpath('%s/system/timezone/input_data/iana' % android_build_top)
-iana_tools_dir = os.path.realpath('%s/system/timezone/input_tools/iana' % android_build_top)
+timezone_dir = os.path.realpath('%s/system/timezone' % android_build_top)
+iana_data_dir = '%s/input_data/iana' % timezone_dir
+iana_tools_dir = '%s/input_tools/iana' % timezone_dir
+
+def OpenFtpConnection():
+  ftp = ftplib.FTP('ftp.iana.org')
+  ftp.login()
+  ftp.cwd('tz/releases')
+  return ftp
+
+
+# ftplib's default blocksize is 8 KiB; 256 KiB recvs cut the syscall count
+# substantially for the ~MB-sized release archives.
+FTP_BLOCK_SIZE = 256 * 1024
+
+
+def FtpRetrieveFile(ftp, filename, local_file):
+  # Accumulate the transfer in memory and write it with a single syscall.
+  # Fine for the ~MB-sized IANA files; would not suit huge downloads.
+  buf = bytearray()
+  ftp.retrbinary('RETR %s' % filename, buf.extend, blocksize=FTP_BLOCK_SIZE)
+  with open(local_file, 'wb') as f:
+    f.write(buf)
 
-def FtpRetrieveFile(ftp, filename):
-  ftp.retrbinary('RETR %s' % filename, open(filename, 'wb').write)
 
+def FtpRetrieveAndVerifyFile(ftp, filename, local_file, signature_file):
+  """Downloads filename to local_file, verifying it as it arrives.
 
-def CheckSignature(data_filename, signature_filename):
-  """Checks the signature of a file."""
-  print('Verifying signature of %s using %s...' % (data_filename, signature_filename))
+  The bytes are teed into a gpg child reading from stdin, so verification
+  overlaps the transfer and the file is not re-read from disk afterwards.
+  Raises if the signature does not match.
+  """
+  gpg = subprocess.Popen(['gpg', '--trusted-key=ED97E90E62AA7E34', '--verify',
+                          signature_file, '-'], stdin=subprocess.PIPE)
   try:
-    subprocess.check_call(['gpg', '--trusted-key=ED97E90E62AA7E34', '--verify',
-                          signature_filename, data_filename])
-  except subprocess.CalledProcessError as err:
-    print('Unable to verify signature')
-    print('\n\n******')
-    print('If this fails for you, you probably need to import Paul Eggert''s public key:')
-    print('  gpg --receive-keys ED97E90E62AA7E34')
-    print('******\n\n')
-    raise
-
-
-def FindLatestRemoteTar(ftp, file_prefix):
-  iana_tar_filenames = []
+    def WriteToGpg(buf):
+      # gpg exits without reading stdin if the signature file itself is bad.
+      # Swallow the resulting broken pipe so the FTP transfer still completes
+      # cleanly; the failure is reported via the exit status below.
+      if not gpg.stdin.closed:
+        try:
+          gpg.stdin.write(buf)
+        except BrokenPipeError:
+          gpg.stdin.close()
+
+    with open(local_file, 'wb', buffering=1024 * 1024) as f:
+      def Tee(buf):
+        f.write(buf)
+        WriteToGpg(buf)
+      ftp.retrbinary('RETR %s' % filename, Tee, blocksize=FTP_BLOCK_SIZE)
+
+    if not gpg.stdin.closed:
+      try:
+        gpg.stdin.close()
+      except BrokenPipeError:
+        pass
+    if gpg.wait() != 0:
+      # One print keeps the block contiguous when downloads log concurrently.
+      print('Unable to verify signature'
+            '\n\n\n******\n'
+            'If this fails for you, you probably need to import Paul Eggert''s public key:\n'
+            '  gpg --receive-keys ED97E90E62AA7E34\n'
+            '******\n\n')
+      raise subprocess.CalledProcessError(gpg.returncode, 'gpg')
+  finally:
+    # Always reap the child, including when the transfer itself fails.
+    if gpg.poll() is None:
+      gpg.kill()
+      gpg.wait()
+
+
+def RetrieveRemoteFileListing():
+  """Fetches the remote release listing once, for use by all prefixes."""
+  ftp = OpenFtpConnection()
+  try:
+    remote_filenames = ftp.nlst()
+  finally:
+    ftp.quit()
 
-  for filename in ftp.nlst():
+  for filename in remote_filenames:
     if "/" in filename:
       print("FTP server returned bogus file name")
       sys.exit(1)
 
+  return remote_filenames
+
+
+def FindLatestRemoteTar(remote_filenames, file_prefix):
+  iana_tar_filenames = []
+
+  for filename in remote_filenames:
     if filename.startswith(file_prefix) and filename.endswith('.tar.gz'):
       iana_tar_filenames.append(filename)
 
@@ -71,49 +138,83 @@ def FindLatestRemoteTar(ftp, file_prefix):
   return iana_tar_filenames[0]
 
 
-def DownloadAndReplaceLocalFiles(file_prefixes, ftp, local_dir):
-  output_files = []
+def DownloadLatestFile(file_prefix, local_dir, remote_filenames):
+  """Downloads the latest file_prefix* file and signature, if it is newer.
+
+  The shared remote listing decides whether a download is needed at all;
+  an FTP connection is only opened when it is. Runs on its own connection
+  so several prefixes can be fetched concurrently. Returns a
+  (file_prefix, downloaded tar file, downloaded signature file, local_dir)
+  tuple, or None if the local file is already up to date. The download is
+  verified against its signature as it arrives; only verified files are
+  returned for installation with ReplaceLocalFile().
+  """
+  latest_iana_tar_filename = FindLatestRemoteTar(remote_filenames, file_prefix)
+  local_iana_tar_file = tzdatautil.GetIanaTarFile(local_dir, file_prefix)
+  if local_iana_tar_file:
+    local_iana_tar_filename = os.path.basename(local_iana_tar_file)
+    if latest_iana_tar_filename <= local_iana_tar_filename:
+      print('Latest remote file for %s is called %s and is older or the same as'
+            ' current local file %s'
+            % (local_dir, latest_iana_tar_filename, local_iana_tar_filename))
+      return None
+
+  print('Found new %s* file for %s: %s' % (file_prefix, local_dir, latest_iana_tar_filename))
+  # Use an explicit per-worker directory rather than
+  # i18nutil.SwitchToNewTemporaryDirectory(): the current directory is shared
+  # by all download threads. Placing it under local_dir keeps it on the same
+  # filesystem, so installing a verified download is a rename, not a copy.
+  download_dir = tempfile.mkdtemp(prefix='.iana-', dir=local_dir)
+  atexit.register(shutil.rmtree, download_dir, ignore_errors=True)
+
+  ftp = OpenFtpConnection()
+  try:
+    # Fetch the (small) signature first so the tarball can be verified while
+    # it downloads.
+    signature_filename = '%s.asc' % latest_iana_tar_filename
+    print('Downloading signature %s...' % signature_filename)
+    signature_file = '%s/%s' % (download_dir, signature_filename)
+    FtpRetrieveFile(ftp, signature_filename, signature_file)
 
-  for file_prefix in file_prefixes:
-    latest_iana_tar_filename = FindLatestRemoteTar(ftp, file_prefix)
-    local_iana_tar_file = tzdatautil.GetIanaTarFile(local_dir, file_prefix)
-    if local_iana_tar_file:
-      local_iana_tar_filename = os.path.basename(local_iana_tar_file)
-      if latest_iana_tar_filename <= local_iana_tar_filename:
-        print('Latest remote file for %s is called %s and is older or the same as'
-              ' current local file %s'
-              % (local_dir, latest_iana_tar_filename, local_iana_tar_filename))
-        continue
+    print('Downloading and verifying file %s...' % latest_iana_tar_filename)
+    iana_tar_file = '%s/%s' % (download_dir, latest_iana_tar_filename)
+    FtpRetrieveAndVerifyFile(ftp, latest_iana_tar_filename, iana_tar_file, signature_file)
+  finally:
+    ftp.quit()
 
-    print('Found new %s* file for %s: %s' % (file_prefix, local_dir, latest_iana_tar_filename))
-    i18nutil.SwitchToNewTemporaryDirectory()
+  return (file_prefix, iana_tar_file, signature_file, local_dir)
 
-    print('Downloading file %s...' % latest_iana_tar_filename)
-    FtpRetrieveFile(ftp, latest_iana_tar_filename)
 
-    signature_filename = '%s.asc' % latest_iana_tar_filename
-    print('Downloading signature %s...' % signature_filename)
-    FtpRetrieveFile(ftp, signature_filename)
+def MoveFile(src_file, dst_file):
+  """Moves src_file to dst_file, falling back to a copy across filesystems."""
+  try:
+    os.replace(src_file, dst_file)
+  except OSError:
+    shutil.copyfile(src_file, dst_file)
+
 
-    CheckSignature(latest_iana_tar_filename, signature_filename)
+def ReplaceLocalFile(file_prefix, iana_tar_file, signature_file, local_dir):
+  """Installs a verified download into local_dir, removing any old files.
 
-    new_local_iana_tar_file = '%s/%s' % (local_dir, latest_iana_tar_filename)
-    shutil.copyfile(latest_iana_tar_filename, new_local_iana_tar_file)
-    new_local_signature_file = '%s/%s' % (local_dir, signature_filename)
-    shutil.copyfile(signature_filename, new_local_signature_file)
+  Returns the list of new local files.
+  """
+  iana_tar_filename = os.path.basename(iana_tar_file)
+  local_iana_tar_file = tzdatautil.GetIanaTarFile(local_dir, file_prefix)
 
-    output_files.append(new_local_iana_tar_file)
-    output_files.append(new_local_signature_file)
+  new_local_iana_tar_file = '%s/%s' % (local_dir, iana_tar_filename)
+  MoveFile(iana_tar_file, new_local_iana_tar_file)
+  new_local_signature_file = '%s/%s' % (local_dir, os.path.basename(signature_file))
+  MoveFile(signature_file, new_local_signature_file)
 
-    # Delete the existing local IANA tar file, if there is one.
-    if local_iana_tar_file:
-      os.remove(local_iana_tar_file)
+  # Delete the existing local IANA tar file, if there is one.
+  if local_iana_tar_file:
+    os.remove(local_iana_tar_file)
 
-    local_signature_file = '%s.asc' % local_iana_tar_file
-    if os.path.exists(local_signature_file):
-      os.remove(local_signature_file)
+  local_signature_file = '%s.asc' % local_iana_tar_file
+  if os.path.exists(local_signature_file):
+    os.remove(local_signature_file)
 
-  return output_files
+  return [new_local_iana_tar_file, new_local_signature_file]
 
 # Run from any directory after having run source/envsetup.sh / lunch
 # See http://www.iana.org/time-zones/ for more about the source of this data.
@@ -128,21 +229,36 @@ def main():
 
   print('Looking for new IANA files...')
 
-  ftp = ftplib.FTP('ftp.iana.org')
-  ftp.login()
-  ftp.cwd('tz/releases')
-
-  output_files = []
+  worklist = []
   if args.tools:
     # The tools and data files are kept separate to make the updates independent.
     # This means we duplicate the tzdata20xx file (once in the tools dir, once
     # in the data dir) but the contents of the data tar appear to be needed for
     # the zic build.
-    new_files = DownloadAndReplaceLocalFiles(['tzdata20', 'tzcode20'], ftp, iana_tools_dir)
-    output_files += new_files
+    worklist.append(('tzdata20', iana_tools_dir))
+    worklist.append(('tzcode20', iana_tools_dir))
   if args.data:
-    new_files = DownloadAndReplaceLocalFiles(['tzdata20'], ftp, iana_data_dir)
-    output_files += new_files
+    worklist.append(('tzdata20', iana_data_dir))
+
+  # Fetch the remote listing once: on the common "no new release" run this is
+  # the only FTP dialogue needed, instead of a login + LIST per prefix.
+  remote_filenames = RetrieveRemoteFileListing()
+
+  # FTP is latency-bound, so fetch the archives concurrently, each on its own
+  # connection.
+  downloads = []
+  with concurrent.futures.ThreadPoolExecutor(max_workers=len(worklist)) as executor:
+    futures = [executor.submit(DownloadLatestFile, file_prefix, local_dir,
+                               remote_filenames)
+               for file_prefix, local_dir in worklist]
+    for future in futures:
+      download = future.result()
+      if download:
+        downloads.append(download)
+
+  output_files = []
+  for file_prefix, iana_tar_file, signature_file, local_dir in downloads:
+    output_files += ReplaceLocalFile(file_prefix, iana_tar_file, signature_file, local_dir)
 
   if len(output_files) == 0:
     print('No files updated')
@@ -22,7 +22,8 @@ import java.util.*;
 // Compile a set of tzfile-formatted files into a single file containing an index.
 //
 // The compilation is controlled by a setup file, which is provided as a
-// command-line argument.  The setup file has the form:
+// command-line argument ("-" reads the setup from standard input, avoiding
+// the need for a temporary file).  The setup file has the form:
 //
 // Link <toName> <fromName>
 // ...
@@ -76,7 +77,9 @@ public class ZoneCompactor {
           String version) throws Exception {
     // Read the setup file and concatenate all the data.
     ByteArrayOutputStream allData = new ByteArrayOutputStream();
-    BufferedReader reader = new BufferedReader(new FileReader(setupFile));
+    BufferedReader reader = setupFile.equals("-")
+        ? new BufferedReader(new InputStreamReader(System.in))
+        : new BufferedReader(new FileReader(setupFile));
     String s;
     int offset = 0;
     while ((s = reader.readLine()) != null) {
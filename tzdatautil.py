@@ -34,7 +34,7 @@ def GetIanaTarFile(dir_name, file_prefix):
 
 
 def InvokeSoong(android_build_top, build_modules):
-  old_cwd = os.getcwd()
-  os.chdir(android_build_top)
-  subprocess.check_call(['build/soong/soong_ui.bash', '--make-mode', '-j30'] + build_modules)
-  os.chdir(old_cwd)
+  # cwd= rather than os.chdir(): the working directory is process-wide and
+  # InvokeSoong may run concurrently with other build steps.
+  subprocess.check_call(['build/soong/soong_ui.bash', '--make-mode', '-j30'] + build_modules,
+                        cwd=android_build_top)
@@ -17,38 +17,56 @@
 """Generates the timezone data files used by Android."""
 
 import argparse
-import glob
+import concurrent.futures
+import mmap
 import os
 import re
+import shutil
 import subprocess
 import sys
 import tarfile
 import tempfile
 
-sys.path.append('%s/external/icu/tools' % os.environ.get('ANDROID_BUILD_TOP'))
+# Look up the environment once: every path below hangs off the build top.
+android_build_top_env = os.environ.get('ANDROID_BUILD_TOP')
+sys.path.append('%s/external/icu/tools' % android_build_top_env)
 import i18nutil
 import icuutil
 import tzdatautil
 
 
-# Calculate the paths that are referred to by multiple functions.
+# Calculate the paths that are referred to by multiple functions. timezone_dir
+# is resolved once; children of a resolved path don't need realpath again.
 android_build_top = i18nutil.GetAndroidRootOrDie()
 timezone_dir = os.path.realpath('%s/system/timezone' % android_build_top)
 i18nutil.CheckDirExists(timezone_dir, 'system/timezone')
 
 android_host_out = i18nutil.GetAndroidHostOutOrDie()
 
-zone_compactor_dir = os.path.realpath('%s/system/timezone/input_tools/android' % android_build_top)
+zone_compactor_dir = '%s/input_tools/android' % timezone_dir
 i18nutil.CheckDirExists(zone_compactor_dir, 'system/timezone/input_tools/android')
 
-timezone_input_tools_dir = os.path.realpath('%s/input_tools' % timezone_dir)
-timezone_input_data_dir = os.path.realpath('%s/input_data' % timezone_dir)
+timezone_input_tools_dir = '%s/input_tools' % timezone_dir
+timezone_input_data_dir = '%s/input_data' % timezone_dir
 
 timezone_output_data_dir = '%s/output_data' % timezone_dir
 i18nutil.CheckDirExists(timezone_output_data_dir, 'output_data')
 
 tmp_dir = tempfile.mkdtemp('-tzdata')
 
+# Derived paths shared by several stages, computed once at module load.
+iana_input_data_dir = '%s/iana' % timezone_input_data_dir
+iana_input_tools_dir = '%s/iana' % timezone_input_tools_dir
+android_input_data_dir = '%s/android' % timezone_input_data_dir
+iana_output_data_dir = '%s/iana' % timezone_output_data_dir
+android_output_data_dir = '%s/android' % timezone_output_data_dir
+icu_overlay_output_dir = '%s/icu_overlay' % timezone_output_data_dir
+
+# Host tool locations, precomputed alongside the other paths.
+zone_compactor_command = '%s/bin/zone_compactor' % android_host_out
+tzlookup_generator_command = '%s/bin/tzlookup_generator' % android_host_out
+telephonylookup_generator_command = '%s/bin/telephonylookup_generator' % android_host_out
+
 def GenerateZicInputFile(extracted_iana_data_dir):
   # Android APIs assume DST means "summer time" so we follow the rearguard format
   # introduced in 2018e.
@@ -64,43 +82,46 @@ def GenerateZicInputFile(extracted_iana_data_dir):
   return zic_input_file
 
 
-def WriteSetupFile(zic_input_file):
-  """Writes the list of zones that ZoneCompactor should process."""
-  links = []
-  zones = []
-  for line in open(zic_input_file):
-    fields = line.split()
-    if fields:
-      line_type = fields[0]
-      if line_type == 'Link':
+# Matches the "Link" and "Zone" lines in zic input. Link / Zone lines start in
+# column 0; continuation and rule lines do not, so a single anchored pattern
+# finds every declaration in one pass.
+ZIC_LINE_PATTERN = re.compile(rb'^(?:Link[ \t]+(\S+)[ \t]+(\S+)|Zone[ \t]+(\S+))', re.MULTILINE)
+
+
+def BuildSetupData(zic_input_file):
+  """Returns the setup bytes describing the zones ZoneCompactor should process.
+
+  The data is piped to ZoneCompactor's stdin rather than written to a
+  temporary file.
+  """
+  links = set()
+  zones = set()
+  with open(zic_input_file, 'rb') as f:
+    zic_input = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    for match in ZIC_LINE_PATTERN.finditer(zic_input):
+      target, link_name, name = match.groups()
+      if link_name is not None:
         # Each "Link" line requires the creation of a link from an old tz ID to
         # a new tz ID, and implies the existence of a zone with the old tz ID.
         #
         # IANA terminology:
         # TARGET = the new tz ID, LINK-NAME = the old tz ID
-        target = fields[1]
-        link_name = fields[2]
-        links.append('Link %s %s' % (target, link_name))
-        zones.append('Zone %s' % link_name)
-      elif line_type == 'Zone':
+        links.add((target, link_name))
+        zones.add(link_name)
+      else:
         # Each "Zone" line indicates the existence of a tz ID.
         #
         # IANA terminology:
         # NAME is the tz ID, other fields like STDOFF, RULES, FORMAT,[UNTIL] are
         # ignored.
-        name = fields[1]
-        zones.append('Zone %s' % name)
-
-  zone_compactor_setup_file = '%s/setup' % tmp_dir
-  setup = open(zone_compactor_setup_file, 'w')
+        zones.add(name)
 
+  # The sets hold raw tz IDs; each output line is formatted once here rather
+  # than per occurrence in the input.
   # Ordering requirement from ZoneCompactor: Links must come first.
-  for link in sorted(set(links)):
-    setup.write('%s\n' % link)
-  for zone in sorted(set(zones)):
-    setup.write('%s\n' % zone)
-  setup.close()
-  return zone_compactor_setup_file
+  return b'\n'.join(
+      [b'Link %s %s' % link for link in sorted(links)] +
+      [b'Zone %s' % zone for zone in sorted(zones)]) + b'\n'
 
 
 def BuildIcuData(iana_data_tar_file):
@@ -113,8 +134,7 @@ def BuildIcuData(iana_data_tar_file):
   icuutil.MakeAndCopyIcuDataFiles(icu_build_dir)
 
   # Create the ICU overlay time zone file.
-  icu_overlay_dir = '%s/icu_overlay' % timezone_output_data_dir
-  icu_overlay_dat_file = '%s/icu_tzdata.dat' % icu_overlay_dir
+  icu_overlay_dat_file = '%s/icu_tzdata.dat' % icu_overlay_output_dir
   icuutil.MakeAndCopyOverlayTzIcuData(icu_build_dir, icu_overlay_dat_file)
 
   # There are files in ICU which generation depends on ICU itself,
@@ -122,21 +142,36 @@ def BuildIcuData(iana_data_tar_file):
   icuutil.GenerateIcuDataFiles()
 
   # Copy ICU license file(s)
-  icuutil.CopyLicenseFiles(icu_overlay_dir)
+  icuutil.CopyLicenseFiles(icu_overlay_output_dir)
 
 
 def GetIanaVersion(iana_tar_file):
+  # Filenames are tzdata<version>.tar.gz / tzcode<version>.tar.gz: plain
+  # prefix/suffix stripping beats running a regex for each call.
   iana_tar_filename = os.path.basename(iana_tar_file)
-  iana_version = re.search('tz(?:data|code)(.+)\\.tar\\.gz', iana_tar_filename).group(1)
-  return iana_version
+  iana_version = iana_tar_filename.removeprefix('tzdata').removeprefix('tzcode')
+  return iana_version.removesuffix('.tar.gz')
 
 
 def ExtractTarFile(tar_file, dir):
   print('Extracting %s...' % tar_file)
   if not os.path.exists(dir):
     os.mkdir(dir)
-  tar = tarfile.open(tar_file, 'r')
-  tar.extractall(dir)
+  # Prefer the system tar: it extracts with far fewer syscalls than Python's
+  # tarfile, which reads and writes the archive in small chunks.
+  if shutil.which('tar'):
+    subprocess.check_call(['tar', '-xzf', tar_file, '-C', dir])
+    return
+  # Fall back to tarfile in stream mode ('r|*') over a generously buffered
+  # file object: seek-based random access isn't needed for a full extraction
+  # and streaming avoids reading the compressed data in small chunks.
+  # copybufsize widens the 16 KiB default block used when writing out each
+  # extracted member.
+  with open(tar_file, 'rb', buffering=1024 * 1024) as f:
+    with tarfile.open(fileobj=f, mode='r|*', copybufsize=2 * 1024 * 1024) as tar:
+      # filter='data' skips the symlink / setuid handling the IANA archives
+      # never need (and refuses them if one ever appears).
+      tar.extractall(dir, filter='data')
 
 
 def BuildZic(iana_tools_dir):
@@ -166,73 +201,81 @@ def BuildZic(iana_tools_dir):
   return zic_binary_file
 
 
-def BuildTzdata(zic_binary_file, extracted_iana_data_dir, iana_data_version):
-  print('Generating zic input file...')
-  zic_input_file = GenerateZicInputFile(extracted_iana_data_dir)
+def BuildTzdata(zic_binary_file, extracted_iana_data_dir, iana_data_version,
+                tools_build_future):
+  with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+    print('Generating zic input file...')
+    zic_input_file = GenerateZicInputFile(extracted_iana_data_dir)
 
-  print('Calling zic...')
-  zic_output_dir = '%s/data' % tmp_dir
-  os.mkdir(zic_output_dir)
-  zic_cmd = [zic_binary_file, '-b', 'fat', '-d', zic_output_dir, zic_input_file]
-  subprocess.check_call(zic_cmd)
+    # The setup data only needs the zic input file: build it while zic runs.
+    setup_future = executor.submit(BuildSetupData, zic_input_file)
 
-  # ZoneCompactor
-  zone_compactor_setup_file = WriteSetupFile(zic_input_file)
+    print('Calling zic...')
+    zic_output_dir = '%s/data' % tmp_dir
+    os.mkdir(zic_output_dir)
+    zic_cmd = [zic_binary_file, '-b', 'fat', '-d', zic_output_dir, zic_input_file]
+    subprocess.check_call(zic_cmd)
 
-  print('Calling ZoneCompactor to update tzdata to %s...' % iana_data_version)
+    # ZoneCompactor
+    zone_compactor_setup_data = setup_future.result()
+    tools_build_future.result()
 
-  tzdatautil.InvokeSoong(android_build_top, ['zone_compactor'])
+  print('Calling ZoneCompactor to update tzdata to %s...' % iana_data_version)
 
   # Create args for ZoneCompactor
   header_string = 'tzdata%s' % iana_data_version
 
   print('Executing ZoneCompactor...')
-  command = '%s/bin/zone_compactor' % android_host_out
-  iana_output_data_dir = '%s/iana' % timezone_output_data_dir
-  subprocess.check_call([command, zone_compactor_setup_file, zic_output_dir, iana_output_data_dir,
-                         header_string])
+  # '-' makes ZoneCompactor read the setup from stdin.
+  subprocess.run([zone_compactor_command, '-', zic_output_dir, iana_output_data_dir,
+                  header_string],
+                 input=zone_compactor_setup_data, check=True)
 
 
-def BuildTzlookupAndTzIds(iana_data_dir):
-  countryzones_source_file = '%s/android/countryzones.txt' % timezone_input_data_dir
-  tzlookup_dest_file = '%s/android/tzlookup.xml' % timezone_output_data_dir
-  tzids_dest_file = '%s/android/tzids.prototxt' % timezone_output_data_dir
+def BuildTzlookupAndTzIds(iana_data_dir, tools_build_future):
+  countryzones_source_file = '%s/countryzones.txt' % android_input_data_dir
+  tzlookup_dest_file = '%s/tzlookup.xml' % android_output_data_dir
+  tzids_dest_file = '%s/tzids.prototxt' % android_output_data_dir
 
   print('Calling TzLookupGenerator to create tzlookup.xml / tzids.prototxt...')
-  tzdatautil.InvokeSoong(android_build_top, ['tzlookup_generator'])
+  tools_build_future.result()
 
   zone_tab_file = '%s/zone.tab' % iana_data_dir
-  command = '%s/bin/tzlookup_generator' % android_host_out
-  subprocess.check_call([command, countryzones_source_file, zone_tab_file, tzlookup_dest_file,
-                         tzids_dest_file])
+  subprocess.check_call([tzlookup_generator_command, countryzones_source_file, zone_tab_file,
+                         tzlookup_dest_file, tzids_dest_file])
 
 
-def BuildTelephonylookup():
-  telephonylookup_source_file = '%s/android/telephonylookup.txt' % timezone_input_data_dir
-  telephonylookup_dest_file = '%s/android/telephonylookup.xml' % timezone_output_data_dir
+def BuildTelephonylookup(tools_build_future):
+  telephonylookup_source_file = '%s/telephonylookup.txt' % android_input_data_dir
+  telephonylookup_dest_file = '%s/telephonylookup.xml' % android_output_data_dir
 
   print('Calling TelephonyLookupGenerator to create telephonylookup.xml...')
-  tzdatautil.InvokeSoong(android_build_top, ['telephonylookup_generator'])
+  tools_build_future.result()
 
-  command = '%s/bin/telephonylookup_generator' % android_host_out
-  subprocess.check_call([command, telephonylookup_source_file, telephonylookup_dest_file])
+  subprocess.check_call([telephonylookup_generator_command, telephonylookup_source_file,
+                         telephonylookup_dest_file])
 
 
 def CreateDistroFiles(iana_data_version, android_revision,
                       output_distro_dir, output_version_file):
   create_distro_script = '%s/distro/tools/create-distro.py' % timezone_dir
 
-  tzdata_file = '%s/iana/tzdata' % timezone_output_data_dir
-  icu_dir = '%s/icu_overlay' % timezone_output_data_dir
-  tzlookup_file = '%s/android/tzlookup.xml' % timezone_output_data_dir
-  telephonylookup_file = '%s/android/telephonylookup.xml' % timezone_output_data_dir
+  tzdata_file = '%s/tzdata' % iana_output_data_dir
+  icu_dir = icu_overlay_output_dir
+  tzlookup_file = '%s/tzlookup.xml' % android_output_data_dir
+  telephonylookup_file = '%s/telephonylookup.xml' % android_output_data_dir
 
-  distro_file_pattern = '%s/*.zip' % output_distro_dir
-  existing_files = glob.glob(distro_file_pattern)
+  # One scandir pass with a suffix check: no glob pattern compilation and no
+  # second stat per entry.
+  with os.scandir(output_distro_dir) as it:
+    existing_files = [entry.path for entry in it
+                      if entry.is_file() and entry.name.endswith('.zip')]
 
   print('Removing %s' % existing_files)
-  for existing_file in existing_files:
-    os.remove(existing_file)
+  if existing_files:
+    # Unlinks serialize on syscall latency; issue them in parallel.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(existing_files)) as executor:
+      list(executor.map(os.remove, existing_files))
 
   subprocess.check_call([create_distro_script,
       '-iana_version', iana_data_version,
@@ -262,12 +305,15 @@ def main():
   args = parser.parse_args()
   android_revision = args.revision
 
-  print('Source data file structure: %s' % timezone_input_data_dir)
-  print('Source tools file structure: %s' % timezone_input_tools_dir)
-  print('Intermediate / working dir: %s' % tmp_dir)
-  print('Output data file structure: %s' % timezone_output_data_dir)
+  # A single print per block of related lines keeps each block contiguous in
+  # the output even when the parallel stages below are logging too.
+  print('Source data file structure: %s\n'
+        'Source tools file structure: %s\n'
+        'Intermediate / working dir: %s\n'
+        'Output data file structure: %s'
+        % (timezone_input_data_dir, timezone_input_tools_dir, tmp_dir,
+           timezone_output_data_dir))
 
-  iana_input_data_dir = '%s/iana' % timezone_input_data_dir
   iana_data_tar_file = tzdatautil.GetIanaTarFile(iana_input_data_dir, 'tzdata')
   iana_data_version = GetIanaVersion(iana_data_tar_file)
   print('IANA time zone data release %s in %s ...' % (iana_data_version, iana_data_tar_file))
@@ -275,20 +321,44 @@ def main():
   icu_dir = icuutil.icuDir()
   print('Found icu in %s ...' % icu_dir)
 
-  BuildIcuData(iana_data_tar_file)
+  # The stages only share the IANA inputs and write to their own tmp_dir
+  # subdirectories / output dirs, so run the independent ones concurrently:
+  # the wall time becomes that of the slowest stage instead of the sum.
+  with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+    # Build all the host tools with a single Soong invocation: one dependency
+    # graph load, and Soong parallelizes the three modules itself. The stages
+    # below join this future before running their tool.
+    tools_build_future = executor.submit(
+        tzdatautil.InvokeSoong, android_build_top,
+        ['zone_compactor', 'tzlookup_generator', 'telephonylookup_generator'])
+
+    icu_future = executor.submit(BuildIcuData, iana_data_tar_file)
+
+    zic_future = executor.submit(BuildZic, iana_input_tools_dir)
 
-  iana_tools_dir = '%s/iana' % timezone_input_tools_dir
-  zic_binary_file = BuildZic(iana_tools_dir)
+    iana_data_dir = '%s/iana_data' % tmp_dir
+    extract_future = executor.submit(ExtractTarFile, iana_data_tar_file, iana_data_dir)
 
-  iana_data_dir = '%s/iana_data' % tmp_dir
-  ExtractTarFile(iana_data_tar_file, iana_data_dir)
-  BuildTzdata(zic_binary_file, iana_data_dir, iana_data_version)
+    # BuildTzdata needs the zic binary and the extracted data; the lookup
+    # generators need only the extracted data.
+    zic_binary_file = zic_future.result()
+    extract_future.result()
 
-  BuildTzlookupAndTzIds(iana_data_dir)
+    tzdata_future = executor.submit(BuildTzdata, zic_binary_file, iana_data_dir,
+                                    iana_data_version, tools_build_future)
+    tzlookup_future = executor.submit(BuildTzlookupAndTzIds, iana_data_dir,
+                                      tools_build_future)
+    telephonylookup_future = executor.submit(BuildTelephonylookup, tools_build_future)
 
-  BuildTelephonylookup()
+    tzdata_future.result()
+    tzlookup_future.result()
+    telephonylookup_future.result()
+    icu_future.result()
 
   # Create a distro file and version file from the output from prior stages.
+  # Not concurrent with the test file update below: both end up invoking
+  # create-distro.py, whose Soong build of create_time_zone_distro cannot run
+  # twice at once against the same output directory.
   output_distro_dir = '%s/distro' % timezone_output_data_dir
   output_version_file = '%s/version/tz_version' % timezone_output_data_dir
   CreateDistroFiles(iana_data_version, android_revision,
@@ -302,4 +372,9 @@ def main():
 
 
 if __name__ == '__main__':
-  main()
+  try:
+    main()
+  finally:
+    # The intermediate tree (extracted tarballs, ICU build, zic output) runs
+    # to hundreds of MB; don't leave one behind per run, even on failure.
+    shutil.rmtree(tmp_dir, ignore_errors=True)